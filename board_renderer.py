@@ -0,0 +1,148 @@
+import io
+import logging
+import threading
+from cachetools import LRUCache
+from PIL import Image, ImageDraw, ImageFont
+
+logger = logging.getLogger(__name__)
+
+
+class BoardRenderer:
+    """Renders boards as PNGs. Boards are identified by their content,
+    (answer length, guesses, feedback), so identical boards share the cached
+    image and the Telegram file_id of the first upload. The guess grid is followed
+by the keyboard, which is derived from the same guesses and feedback."""
+    MAX_GUESSES = 6
+    TILE_SIZE = 64
+    TILE_GAP = 6
+    PADDING = 12
+    FONT_PATH = 'DejaVuSans-Bold.ttf'
+    FONT_SIZE = 36
+    KEY_WIDTH = 32
+    KEY_HEIGHT = 44
+    KEY_GAP = 4
+    KEY_FONT_SIZE = 20
+    KEYBOARD_ROWS = ['qwertyuiop', 'asdfghjkl', 'zxcvbnm']
+    BACKGROUND = (18, 18, 19)
+    EMPTY_BORDER = (58, 58, 60)
+    TEXT_COLOUR = (255, 255, 255)
+    UNUSED_KEY_COLOUR = (129, 131, 132)
+    # Indexed by feedback: 0 for wrong letter, 1 for wrong position, 2 for right position
+    TILE_COLOURS = [(58, 58, 60), (181, 159, 59), (83, 141, 78)]
+
+    def __init__(self, max_boards=256, max_file_ids=4096):
+        self._lock = threading.Lock()
+        self._boards = LRUCache(maxsize=max_boards)
+        self._file_ids = LRUCache(maxsize=max_file_ids)
+        # Keyed by (letter, feedback, size), so this holds at most a few hundred small tiles
+        self._tiles = {}
+        self.font = self.load_font(self.FONT_SIZE)
+        self.key_font = self.load_font(self.KEY_FONT_SIZE)
+
+    def load_font(self, size: int):
+        try:
+            return ImageFont.truetype(self.FONT_PATH, size)
+        except OSError:
+            logger.warning(f'{self.FONT_PATH} not found, using the default font')
+            return ImageFont.load_default()
+
+    def get_photo(self, board: tuple):
+        """Returns the file_id of an earlier upload of this board if there is one,
+        otherwise the rendered PNG bytes."""
+        with self._lock:
+            file_id = self._file_ids.get(board)
+            png = self._boards.get(board) if file_id is None else None
+        if file_id is not None:
+            return file_id
+        if png is None:
+            png = self.render(board)
+            with self._lock:
+                self._boards[board] = png
+        return png
+
+    def remember_file_id(self, board: tuple, photo_sizes: list) -> None:
+        if not photo_sizes:
+            return
+        with self._lock:
+            # Telegram lists the sizes smallest first
+            self._file_ids[board] = photo_sizes[-1].file_id
+            self._boards.pop(board, None)
+
+    def forget_file_id(self, board: tuple) -> None:
+        with self._lock:
+            self._file_ids.pop(board, None)
+
+    def render(self, board: tuple) -> bytes:
+        answer_length, guesses, feedback = board
+        tile_step = self.TILE_SIZE + self.TILE_GAP
+        key_step = self.KEY_WIDTH + self.KEY_GAP
+        grid_width = answer_length * tile_step - self.TILE_GAP
+        keyboard_width = max(len(row) for row in self.KEYBOARD_ROWS) * key_step - self.KEY_GAP
+        width = max(grid_width, keyboard_width) + 2 * self.PADDING
+        grid_height = self.MAX_GUESSES * tile_step - self.TILE_GAP
+        keyboard_height = len(self.KEYBOARD_ROWS) * (self.KEY_HEIGHT + self.KEY_GAP) - self.KEY_GAP
+        height = grid_height + keyboard_height + 3 * self.PADDING
+        image = Image.new('RGB', (width, height), self.BACKGROUND)
+
+        grid_left = (width - grid_width) // 2
+        for i in range(self.MAX_GUESSES):
+            top = self.PADDING + i * tile_step
+            for j in range(answer_length):
+                if i < len(guesses):
+                    tile = self.get_tile(guesses[i][j], feedback[i][j], (self.TILE_SIZE, self.TILE_SIZE))
+                else:
+                    tile = self.get_tile(' ', None, (self.TILE_SIZE, self.TILE_SIZE))
+                image.paste(tile, (grid_left + j * tile_step, top))
+
+        key_results = self.get_key_results(guesses, feedback)
+        for i, row in enumerate(self.KEYBOARD_ROWS):
+            row_left = (width - (len(row) * key_step - self.KEY_GAP)) // 2
+            top = grid_height + 2 * self.PADDING + i * (self.KEY_HEIGHT + self.KEY_GAP)
+            for j, c in enumerate(row):
+                tile = self.get_tile(c, key_results.get(c), (self.KEY_WIDTH, self.KEY_HEIGHT))
+                image.paste(tile, (row_left + j * key_step, top))
+
+        output = io.BytesIO()
+        image.save(output, format='PNG', optimize=True)
+        return output.getvalue()
+
+    @staticmethod
+    def get_key_results(guesses: tuple, feedback: tuple) -> dict:
+        """Best feedback seen for each guessed letter, as in GameController.format_keyboard."""
+        key_results = {}
+        for guess, results in zip(guesses, feedback):
+            for c, result in zip(guess, results):
+                key_results[c] = max(result, key_results.get(c, 0))
+        return key_results
+
+    def get_tile(self, letter: str, result, size: tuple) -> Image.Image:
+        key = (letter, result, size)
+        with self._lock:
+            tile = self._tiles.get(key)
+        if tile is None:
+            tile = self.render_tile(letter, result, size)
+            with self._lock:
+                self._tiles[key] = tile
+        return tile
+
+    def render_tile(self, letter: str, result, size: tuple) -> Image.Image:
+        """Renders a single tile. Grid tiles without a result are drawn as empty outlines,
+        keys without a result as unused keys."""
+        width, height = size
+        is_key = size != (self.TILE_SIZE, self.TILE_SIZE)
+        tile = Image.new('RGB', size, self.BACKGROUND)
+        draw = ImageDraw.Draw(tile)
+        box = (0, 0, width - 1, height - 1)
+        if result is None and not is_key:
+            draw.rectangle(box, outline=self.EMPTY_BORDER, width=2)
+            return tile
+        draw.rectangle(box, fill=self.UNUSED_KEY_COLOUR if result is None else self.TILE_COLOURS[result])
+        font = self.key_font if is_key else self.font
+        text_left, text_top, text_right, text_bottom = draw.textbbox((0, 0), letter.upper(), font=font)
+        draw.text(
+            ((width - (text_right - text_left)) / 2 - text_left, (height - (text_bottom - text_top)) / 2 - text_top),
+            letter.upper(), font=font, fill=self.TEXT_COLOUR)
+        return tile
+
+
+board_renderer = BoardRenderer()
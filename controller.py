@@ -2,6 +2,7 @@ import logging
 from models.game import Game
 from app import db
 from constants import SERVER_ERROR
+from profiler import timed_stage
 
 logger = logging.getLogger(__name__)
 legal_words = []
@@ -24,7 +25,8 @@ class GameController:
 
     def retrieve_game(self, counter=0):
         try:
-            return Game.query.filter_by(chat_id=self.chat_id).order_by(Game.id.desc()).first()
+            with timed_stage('db fetch'):
+                return Game.query.filter_by(chat_id=self.chat_id).order_by(Game.id.desc()).first()
         except Exception as e:
             logger.error(e)
             db.session.close()
@@ -47,7 +49,9 @@ class GameController:
         word = word.lower()
         if not self.is_game_ongoing():
             return 'There is no ongoing game! Start a new one with /start.'
-        if not self.is_guess_legal(word):
+        with timed_stage('dictionary check'):
+            is_guess_legal = self.is_guess_legal(word)
+        if not is_guess_legal:
             return f'"{word}" is invalid! Your guess must be a legal word of {len(self.game.answer)} letters! Use /guess to try again.'
         if not self.add_guess(word, guesser_username):
             return SERVER_ERROR
@@ -65,45 +69,71 @@ class GameController:
         guesses = self.game.get_guesses()
         if not guesses:
             return 'There have been no guesses so far. Use /guess to guess.'
-        row = []
-        for i in range(len(guesses)):
-            row.append(f"""<code>{'  '.join([c for c in guesses[i]['guess'].upper()])}</code>""")
-            row.append(self.format_guess_result(guesses[i]['guess']))
-            row.append(f"({guesses[i]['by']}: {i+1}/{self.MAX_GUESSES})")
-        history = f"Game started by {self.game.setter_username}\n" + "\n".join(row)
-        if guesses[-1]['guess'].lower() == self.game.answer:
-            history += "\nCongratulations! Use /start to play again! #wordlewithfriends"
-        elif len(guesses) == self.MAX_GUESSES:
-            history += f"\nBetter luck next time! The answer was {self.game.answer.upper()}. Use /start to start another game! #wordlewithfriends"
-        else:
-            history += f"\n{self.format_keyboard()}"
-        return history
+        with timed_stage('scoring'):
+            results = [self.format_guess_result(guess['guess']) for guess in guesses]
+        with timed_stage('rendering'):
+            row = []
+            for i in range(len(guesses)):
+                row.append(f"""<code>{'  '.join([c for c in guesses[i]['guess'].upper()])}</code>""")
+                row.append(results[i])
+                row.append(f"({guesses[i]['by']}: {i+1}/{self.MAX_GUESSES})")
+            history = f"Game started by {self.game.setter_username}\n" + "\n".join(row)
+            if guesses[-1]['guess'].lower() == self.game.answer:
+                history += "\nCongratulations! Use /start to play again! #wordlewithfriends"
+            elif len(guesses) == self.MAX_GUESSES:
+                history += f"\nBetter luck next time! The answer was {self.game.answer.upper()}. Use /start to start another game! #wordlewithfriends"
+            else:
+                history += f"\n{self.format_keyboard()}"
+            return history
 
     def format_guess_result(self, guess: str) -> str:
+        squares = [self.BLACK_SQUARE, self.YELLOW_SQUARE, self.GREEN_SQUARE]
+        return ' '.join([squares[result] for result in self.score_guess(guess)])
+
+    def score_guess(self, guess: str) -> list:
+        # 0 for wrong letter, 1 for wrong position, 2 for right position
         answer = self.game.answer
         has_char_in_answer_been_found = [False for _ in guess]
-        guess_result = [self.BLACK_SQUARE for _ in guess]
+        guess_result = [0 for _ in guess]
 
         # Check green squares first
         for i in range(len(guess)):
             if answer[i] == guess[i]:
-                guess_result[i] = self.GREEN_SQUARE
+                guess_result[i] = 2
                 has_char_in_answer_been_found[i] = True
 
         # Check for orange squres
         for i in range(len(guess)):
             # If it's not in answer or has already been filled, skip
-            if guess_result[i] == self.GREEN_SQUARE or guess[i] not in answer:
+            if guess_result[i] == 2 or guess[i] not in answer:
                 continue
             # Search
             for j in range(len(answer)):
                 # There is a character in answer corresponding to guess
                 if not has_char_in_answer_been_found[j] and guess[i] == answer[j]:
                     has_char_in_answer_been_found[j] = True
-                    guess_result[i] = self.YELLOW_SQUARE
+                    guess_result[i] = 1
                     break
-        return ' '.join(guess_result)
-    
+        return guess_result
+
+    def get_board(self) -> tuple:
+        """Returns (answer length, guesses, feedback), which identifies the rendered board image."""
+        guesses = tuple(guess['guess'] for guess in self.game.get_guesses())
+        with timed_stage('scoring'):
+            feedback = tuple(tuple(self.score_guess(guess)) for guess in guesses)
+        return len(self.game.answer), guesses, feedback
+
+    def format_board_caption(self) -> str:
+        guesses = self.game.get_guesses()
+        # Guesser names are not part of the board, so identical boards can share one image
+        rows = [f"{guess['guess'].upper()} ({guess['by']}: {i+1}/{self.MAX_GUESSES})" for i, guess in enumerate(guesses)]
+        caption = f"Game started by {self.game.setter_username}\n" + "\n".join(rows)
+        if guesses and guesses[-1]['guess'].lower() == self.game.answer:
+            caption += "\nCongratulations! Use /start to play again! #wordlewithfriends"
+        elif len(guesses) == self.MAX_GUESSES:
+            caption += f"\nBetter luck next time! The answer was {self.game.answer.upper()}. #wordlewithfriends"
+        return caption
+
     def format_keyboard(self):
         if not self.game or not self.game.get_guesses():
             return ''
@@ -147,8 +177,9 @@ class GameController:
                 self.game = None
             game = Game(chat_id=self.chat_id, answer=answer.lower(),
                         setter_chat_id=setter_chat_id, setter_username=setter_username)
-            db.session.add(game)
-            db.session.commit()
+            with timed_stage('db write'):
+                db.session.add(game)
+                db.session.commit()
             self.game = game
             return True
         except Exception as e:
@@ -161,8 +192,9 @@ class GameController:
 
     def add_guess(self, guess: str, guesser_username: str, counter=0) -> bool:
         try:
-            self.game.add_guess(guess, guesser_username)
-            db.session.commit()
+            with timed_stage('db write'):
+                self.game.add_guess(guess, guesser_username)
+                db.session.commit()
             return True
         except Exception as e:
             logger.error(e)
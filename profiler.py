@@ -0,0 +1,135 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler:
+    """Periodically samples the stacks of the dispatcher threads and writes them
+    in the collapsed format understood by flamegraph.pl and speedscope."""
+    DEFAULT_INTERVAL = 0.005
+    MAX_SECONDS = 300
+    # python-telegram-bot names its threads Bot:<id>:dispatcher and Bot:<id>:worker:<id>:<n>
+    THREAD_NAME_MARKERS = (':dispatcher', ':worker:')
+
+    def __init__(self, output_dir='profiles', interval=DEFAULT_INTERVAL, include_idle=False):
+        self.output_dir = output_dir
+        self.interval = interval
+        # Idle threads block in queue.get, which would otherwise dominate the output
+        self.include_idle = include_idle
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float, on_complete=None) -> bool:
+        """Profile for the given number of seconds in a background thread.
+        on_complete(path, samples) is called once the output file is written."""
+        with self._lock:
+            if self.is_running():
+                return False
+            seconds = min(seconds, self.MAX_SECONDS)
+            self._thread = threading.Thread(
+                target=self._run, args=(seconds, on_complete), name='profiler', daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self, seconds: float, on_complete) -> None:
+        logger.info(f'profiling dispatcher threads for {seconds}s')
+        stacks = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()
+                     if self.should_sample(thread.name)}
+            for ident, frame in sys._current_frames().items():
+                if ident in names and (self.include_idle or not self.is_idle(frame)):
+                    stacks[self.collapse(names[ident], frame)] += 1
+            time.sleep(self.interval)
+        try:
+            path = self.write(stacks)
+            logger.info(f'profile written to {path} ({sum(stacks.values())} samples)')
+            if on_complete:
+                on_complete(path, sum(stacks.values()))
+        except Exception as e:
+            logger.error(e)
+
+    def should_sample(self, thread_name: str) -> bool:
+        return any(marker in thread_name for marker in self.THREAD_NAME_MARKERS)
+
+    @staticmethod
+    def is_idle(frame) -> bool:
+        """True if the thread is waiting on an empty queue, i.e. in threading.Condition.wait under queue.Queue.get."""
+        caller = frame.f_back
+        return (frame.f_code.co_name == 'wait' and os.path.basename(frame.f_code.co_filename) == 'threading.py'
+                and caller is not None and caller.f_code.co_name == 'get'
+                and os.path.basename(caller.f_code.co_filename) == 'queue.py')
+
+    @staticmethod
+    def collapse(thread_name: str, frame) -> str:
+        functions = []
+        while frame is not None:
+            code = frame.f_code
+            functions.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        return ';'.join([thread_name] + functions[::-1])
+
+    def write(self, stacks: Counter) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, time.strftime('profile-%Y%m%d-%H%M%S.folded'))
+        with open(path, 'w') as file:
+            for stack, count in stacks.most_common():
+                file.write(f'{stack} {count}\n')
+        return path
+
+
+class StageTimer:
+    """Logs handler calls slower than threshold_ms with a per-stage breakdown.
+    While threshold_ms is None, handlers and stages run untimed."""
+
+    def __init__(self, threshold_ms=None):
+        self.threshold_ms = threshold_ms
+        self._local = threading.local()
+
+    @contextmanager
+    def stage(self, name: str):
+        stages = getattr(self._local, 'stages', None)
+        if stages is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stages[name] = stages.get(name, 0) + time.perf_counter() - start
+
+    def timed(self, handler):
+        @wraps(handler)
+        def wrapper(*args, **kwargs):
+            threshold_ms = self.threshold_ms
+            if threshold_ms is None:
+                return handler(*args, **kwargs)
+            self._local.stages = {}
+            start = time.perf_counter()
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                stages = self._local.stages
+                self._local.stages = None
+                if elapsed_ms >= threshold_ms:
+                    breakdown = ', '.join(f'{name}={seconds * 1000:.1f}ms' for name, seconds in stages.items())
+                    logger.warning(f'slow handler {handler.__name__}: {elapsed_ms:.1f}ms ({breakdown or "no stages"})')
+        return wrapper
+
+
+profiler = SamplingProfiler(os.environ.get('PROFILE_DIR', 'profiles'))
+stage_timer = StageTimer()
+timed_stage = stage_timer.stage
+timed_handler = stage_timer.timed
@@ -14,15 +14,20 @@ bot.
 """
 
 import logging
+import math
+import signal
 from dotenv import load_dotenv
 import os
-from telegram import ParseMode, Update
+from telegram import Message, ParseMode, Update
+from telegram.error import BadRequest
 from telegram.ext import Updater, CommandHandler, CallbackContext, Filters, ConversationHandler, MessageHandler
 from telegram.utils import helpers
 from controller import GameController
 from enum import IntEnum
 from app import db
 from constants import SERVER_ERROR
+from board_renderer import board_renderer
+from profiler import profiler, stage_timer, timed_handler, timed_stage
 
 # Enable logging
 logging.basicConfig(
@@ -33,11 +38,13 @@ logger = logging.getLogger(__name__)
 START_GAME_DEEP_LINK = 'start-game'
 SET_WORD_DEEP_LINK = 'set-word'
 MESSAGE_FOR_INVALID_COMMANDS_IN_PRIVATE_CHAT = "It's called Wordle with Friends! Use /start to start a game with your friends."
+DEFAULT_PROFILE_SECONDS = 30
 
 class ConversationStates(IntEnum):
     SET_WORD = 1
 
 
+@timed_handler
 def start(update: Update, context: CallbackContext):
     """Send a message when the command /start is issued."""
     if update.effective_chat.type == 'private':
@@ -60,6 +67,7 @@ def start(update: Update, context: CallbackContext):
             update.message.reply_text(SERVER_ERROR)
 
 
+@timed_handler
 def set_word(update: Update, context: CallbackContext):
     word = update.message.text.split(' ')[0] if update.message.text else ''
     if GameController.is_answer_legal(word):
@@ -76,11 +84,13 @@ def set_word(update: Update, context: CallbackContext):
             "Please set a valid word! \nWords must be between 4 to 6 letters and present in the dictionary. \nUse /cancel to exit.")
 
 
+@timed_handler
 def cancel(update: Update, context: CallbackContext):
     update.message.reply_text("Ok! Start a new game with /start")
     return ConversationHandler.END
 
 
+@timed_handler
 def handle_after_choosing_group(update: Update, context: CallbackContext) -> None:
     try:
         chat_id = update.effective_chat.id
@@ -99,17 +109,21 @@ def handle_after_choosing_group(update: Update, context: CallbackContext) -> Non
         update.message.reply_text(SERVER_ERROR)
 
 
+@timed_handler
 def history(update: Update, context: CallbackContext) -> None:
     try:
         if update.effective_chat.type == 'private':
             update.message.reply_text(MESSAGE_FOR_INVALID_COMMANDS_IN_PRIVATE_CHAT)
             return
         controller = GameController(update.message.chat_id)
-        update.message.reply_text(controller.display_past_guesses(), parse_mode=ParseMode.HTML)
+        text = controller.display_past_guesses()
+        with timed_stage('send'):
+            update.message.reply_text(text, parse_mode=ParseMode.HTML)
     except: 
         update.message.reply_text(SERVER_ERROR)
 
 
+@timed_handler
 def guess(update: Update, context: CallbackContext) -> None:
     if not update.message:
         return
@@ -122,15 +136,61 @@ def guess(update: Update, context: CallbackContext) -> None:
         if not context.args:
             update.message.reply_text('Please type a word after /guess.')
             return
-        update.message.reply_text(
-            controller.try_guessing(context.args[0], update.effective_user.first_name), 
-            parse_mode=ParseMode.HTML)
+        text = controller.try_guessing(context.args[0], update.effective_user.first_name)
+        with timed_stage('send'):
+            update.message.reply_text(text, parse_mode=ParseMode.HTML)
     except Exception as e:
         logger.error(e)
         logger.error(update)
         update.message.reply_text(SERVER_ERROR)
 
 
+@timed_handler
+def board(update: Update, context: CallbackContext) -> None:
+    """Send the board as an image. Rendering is CPU heavy, so it and the upload
+    run on the dispatcher's worker pool while the DB work stays on this thread."""
+    try:
+        if update.effective_chat.type == 'private':
+            update.message.reply_text(MESSAGE_FOR_INVALID_COMMANDS_IN_PRIVATE_CHAT)
+            return
+        controller = GameController(update.message.chat_id)
+        if not controller.game or not controller.game.get_guesses():
+            update.message.reply_text(controller.display_past_guesses(), parse_mode=ParseMode.HTML)
+            return
+        context.dispatcher.run_async(
+            send_board, update.message, controller.get_board(), controller.format_board_caption(), update=update)
+    except Exception as e:
+        logger.error(e)
+        update.message.reply_text(SERVER_ERROR)
+
+
+@timed_handler
+def send_board(message: Message, game_board: tuple, caption: str) -> None:
+    try:
+        with timed_stage('rendering'):
+            photo = board_renderer.get_photo(game_board)
+        try:
+            with timed_stage('send'):
+                sent = message.reply_photo(photo, caption=caption, allow_sending_without_reply=True)
+        except BadRequest as e:
+            # A cached file_id can go stale, e.g. after the bot token changes
+            if isinstance(photo, bytes) or 'file' not in str(e).lower():
+                raise
+            board_renderer.forget_file_id(game_board)
+            with timed_stage('rendering'):
+                photo = board_renderer.get_photo(game_board)
+            with timed_stage('send'):
+                sent = message.reply_photo(photo, caption=caption, allow_sending_without_reply=True)
+        board_renderer.remember_file_id(game_board, sent.photo)
+    except Exception as e:
+        logger.error(e)
+        try:
+            message.reply_text(SERVER_ERROR, allow_sending_without_reply=True)
+        except Exception as e:
+            logger.error(e)
+
+
+@timed_handler
 def help_command(update: Update, context: CallbackContext) -> None:
     """Send a message when the command /help is issued."""
     update.message.reply_text(
@@ -141,18 +201,76 @@ def help_command(update: Update, context: CallbackContext) -> None:
             "/start to start a game",
             "/guess [word] to guess the word",
             "/history to see past guesses",
+            "/board to see the board as an image",
             "",
             "Please email wordlewithfriendsbot@gmail.com for bug reports and suggestions."
         ])
     )
 
 
+def get_admin_user_ids() -> set:
+    return {int(user_id) for user_id in os.environ.get('ADMIN_USER_IDS', '').split(',') if user_id.strip()}
+
+
+def parse_positive_number(value: str) -> float:
+    number = float(value)
+    if not math.isfinite(number) or number <= 0:
+        raise ValueError(f'{value} is not a positive number')
+    return number
+
+
+@timed_handler
+def profile(update: Update, context: CallbackContext) -> None:
+    """Admin only. /profile [seconds] samples the dispatcher threads,
+    /profile slow [ms|off] logs handlers slower than the threshold."""
+    try:
+        if context.args and context.args[0] == 'slow':
+            if len(context.args) > 1:
+                threshold = context.args[1]
+                stage_timer.threshold_ms = None if threshold == 'off' else parse_positive_number(threshold)
+            threshold_ms = stage_timer.threshold_ms
+            update.message.reply_text(
+                f'Slow handler threshold: {"off" if threshold_ms is None else f"{threshold_ms:g}ms"}')
+            return
+        seconds = parse_positive_number(context.args[0]) if context.args else DEFAULT_PROFILE_SECONDS
+    except ValueError:
+        update.message.reply_text('Usage: /profile [seconds] or /profile slow [ms|off]')
+        return
+    chat_id = update.effective_chat.id
+
+    def send_profile(path, samples):
+        with open(path, 'rb') as file:
+            context.bot.send_document(chat_id, file, caption=f'{samples} samples')
+
+    if profiler.start(seconds, on_complete=send_profile):
+        update.message.reply_text(f'Profiling for {min(seconds, profiler.MAX_SECONDS):g}s...')
+    else:
+        update.message.reply_text('A profile is already running.')
+
+
+def handle_profile_signal(signum, frame) -> None:
+    profiler.start(DEFAULT_PROFILE_SECONDS)
+
+
 def main() -> None:
     """Start the bot."""
     logger.info("bot started")
     if os.environ.get('ENV') != 'prod':
         load_dotenv()
     updater = Updater(os.environ.get('TELEGRAM_TOKEN'))
+    try:
+        if os.environ.get('SLOW_HANDLER_THRESHOLD_MS'):
+            stage_timer.threshold_ms = parse_positive_number(os.environ['SLOW_HANDLER_THRESHOLD_MS'])
+    except ValueError:
+        logger.error(f"Invalid SLOW_HANDLER_THRESHOLD_MS: {os.environ['SLOW_HANDLER_THRESHOLD_MS']}")
+    try:
+        admin_user_ids = get_admin_user_ids()
+    except ValueError:
+        logger.error(f"Invalid ADMIN_USER_IDS: {os.environ['ADMIN_USER_IDS']}")
+        admin_user_ids = set()
+    # `kill -USR1 <pid>` profiles the running bot without going through Telegram
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, handle_profile_signal)
 
     # Get the dispatcher to register handlers
     dispatcher = updater.dispatcher
@@ -164,7 +282,10 @@ def main() -> None:
 
     dispatcher.add_handler(CommandHandler("history", history))
     dispatcher.add_handler(CommandHandler("guess", guess))
+    dispatcher.add_handler(CommandHandler("board", board))
     dispatcher.add_handler(CommandHandler("help", help_command))
+    # Only admins get through the filter, and updates without a user never do
+    dispatcher.add_handler(CommandHandler("profile", profile, Filters.user(user_id=admin_user_ids)))
 
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler('start', start)],